@@ -0,0 +1,86 @@
+"""
+Memory benchmark: DeviceStore vs the plain list of dicts returned by SheetsRepository.list_devices().
+Run from the repo root: python benchmarks/deviceStoreMemory.py [devices_count]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deviceStore import DeviceStore
+
+QUEUES = ["1/1", "1/2", "2/1", "2/2", "3/1", "3/2", "4/1", "4/2", "5/1", "5/2", "6/1", "6/2"]
+DEVICE_TYPES = ["IOS", "ANDROID", "WEB"]
+
+
+def make_payload(count: int) -> str:
+    # Raw Sheets API "values" json, parsed on every build so every row gets fresh string objects
+    return json.dumps([
+        [
+            str(uuid.uuid4()),
+            DEVICE_TYPES[i % len(DEVICE_TYPES)],
+            f"fcm-token-{uuid.uuid4().hex}{uuid.uuid4().hex}{uuid.uuid4().hex}"[:152],
+            QUEUES[i % len(QUEUES)],
+            "",
+        ]
+        for i in range(count)
+    ])
+
+
+def as_dicts(rows: List[List[str]]) -> List[Dict[str, str]]:
+    return [
+        {
+            "device_uuid": row[0],
+            "device_type": row[1],
+            "push_address": row[2],
+            "watched_queue": row[3],
+            "device_details": row[4],
+        }
+        for row in rows
+    ]
+
+
+def measure(name: str, build: Callable[[], object]) -> object:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} retained {current / 1024 / 1024:8.2f} MB   peak {peak / 1024 / 1024:8.2f} MB   build {elapsed * 1000:8.1f} ms")
+    return result
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"Devices: {count}")
+    payload = make_payload(count)
+
+    devices_list = measure("list of dicts", lambda: as_dicts(json.loads(payload)))
+    store = measure("DeviceStore", lambda: DeviceStore.from_records(as_dicts(json.loads(payload))))
+
+    # Fan-out of one queue: push tokens to send, as /checkChanges and reminders collect them
+    started = time.perf_counter()
+    scanned = [device["push_address"] for device in devices_list if device["watched_queue"] == "3/2"]
+    scan_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    sliced = store.queue_tokens("3/2")
+    slice_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    iterated = [push_address for _, _, push_address in store.iter_queue("3/2")]
+    iter_ms = (time.perf_counter() - started) * 1000
+    assert sorted(scanned) == sorted(sliced) == sorted(iterated)
+    print(
+        f"queue 3/2 tokens ({len(sliced)}): list scan {scan_ms:.2f} ms, "
+        f"store token slice {slice_ms:.3f} ms, store iter_queue {iter_ms:.3f} ms"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,219 @@
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple
 import json
-from datetime import datetime
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
 import logging
 
 from oblEnergoDataRetriver import OblEnergoDataRetriever
-from oblEnergoResponseUnwrapper import get_changes
+from oblEnergoResponseUnwrapper import get_changes, parse_intervals
 from sheetsRepository import SheetsRepository
+from sharedState import SharedStateStore
+from deviceStore import DeviceStore
+from timeIntervalsEx import TimeIntervalsEX
+from queueCatalog import QueueCatalog
+from scheduleHistory import ScheduleHistory
 
 logger = logging.getLogger(__name__)
 
 class ChangesDetector:
-    #LocalStorage
+    # populate(): the downloading worker's lease and how often the others check it
+    POPULATE_LEASE_SECONDS = 60
+    POPULATE_POLL_SECONDS = 0.5
+
+    #LocalStorage (per worker copy of the shared state)
     last_update_devices: datetime
     last_update_queues: datetime
-    devices_list: List[Dict[str, str]]
+    last_sync: datetime
+    devices: DeviceStore
     queue_list: List[Dict[str, str]]
+    schedules: Dict[str, TimeIntervalsEX]
+    queues_updated_at: datetime
+    devices_seq: int
+    queues_seq: int
+    # Wall time in seconds of every seek_changes phase of the last sweep
+    last_phases: Dict[str, float]
 
     def __init__(
             self,
-            repo_handler: SheetsRepository):
+            repo_handler: SheetsRepository,
+            shared_state: SharedStateStore,
+            queue_catalog: QueueCatalog,
+            history: ScheduleHistory,
+            sync_interval: timedelta = timedelta(seconds=5),
+            poll_interval: timedelta = timedelta(minutes=10)):
         self.repo_handler = repo_handler
+        self.shared_state = shared_state
+        self.queue_catalog = queue_catalog
+        self.history = history
+        # Max staleness of the local copy compared to the shared state
+        self.sync_interval = sync_interval
+        # How often /checkChanges is triggered externally
+        self.poll_interval = poll_interval
+        self.devices = DeviceStore()
+        self.queue_list = []
+        self.schedules = {}
+        self.queues_updated_at = datetime.min
+        # Called with {queue: new schedule} for queues whose intervals changed
+        self.schedule_listeners: List[Callable[[Dict[str, TimeIntervalsEX]], None]] = []
+        # sync() is called from request threads too
+        self._sync_lock = threading.Lock()
+        self.devices_seq = 0
+        self.queues_seq = 0
+        self.last_sync = datetime.min
+        self.last_phases = {}
 
 # Initial data read task
+# Only one worker downloads from Sheets, the rest wait for it and pick the data up from the shared state
     def populate(self) -> None:
         logger.info("Start populating changes detector")
-        self.queue_list = self.repo_handler.list_intervals()
-        self.devices_list = self.repo_handler.list_devices()
-        self.last_update_queues = datetime.now()
-        self.last_update_devices = datetime.now()
-        logger.info(f"End populating changes detector. Queues count: {len(self.queue_list)}. Devices count: {len(self.devices_list)}")
+        while True:
+            if self.shared_state.try_acquire_lease("populate", ttl_seconds=self.POPULATE_LEASE_SECONDS):
+                logger.info("Populate lease acquired, downloading data from storage")
+                try:
+                    self.shared_state.replace_intervals(self.repo_handler.list_intervals())
+                    self.shared_state.replace_devices(self.repo_handler.list_devices())
+                finally:
+                    self.shared_state.release_lease("populate")
+                break
+
+            logger.info("Another worker is downloading data from storage, waiting for it")
+            while self.shared_state.lease_held("populate"):
+                time.sleep(self.POPULATE_POLL_SECONDS)
+            if self.shared_state.devices_seq() and self.shared_state.intervals_seq():
+                break
+            # The downloading worker died before publishing, take over
+        self.sync(force=True)
+        logger.info(f"End populating changes detector. Queues count: {len(self.queue_list)}. Devices count: {len(self.devices)}")
+
+# Pull shared state changes made by other workers
+    def sync(self, force: bool = False) -> None:
+        with self._sync_lock:
+            now = datetime.now()
+            if not force and now - self.last_sync < self.sync_interval:
+                return
+            self.last_sync = now
+            self._sync_devices(now)
+            self._sync_queues(now)
+
+    def _sync_devices(self, now: datetime) -> None:
+        if self.shared_state.devices_seq() == self.devices_seq:
+            return
+
+        # Published stores are never modified: request threads and the event loop read them
+        # without locks, so changes are applied to a copy which then replaces the current store
+        changes = self.shared_state.devices_changed_since(self.devices_seq)
+        if changes is None:
+            # Devices were replaced as a whole, rebuild
+            devices_seq, devices_list = self.shared_state.list_devices()
+            devices = DeviceStore.from_records(devices_list)
+        else:
+            devices_seq, upserted, deleted = changes
+            devices = self.devices.copy()
+            for device in upserted:
+                devices.upsert(device)
+            for device_uuid in deleted:
+                devices.delete(device_uuid)
+        # Store first, so a reader taking devices_seq and then devices never gets an older store
+        self.devices = devices
+        self.devices_seq = devices_seq
+        self.last_update_devices = now
+        logger.info(f"Synced devices list. Seq: {self.devices_seq}. Devices count: {len(self.devices)}")
+
+    def _sync_queues(self, now: datetime) -> None:
+        if self.shared_state.intervals_seq() == self.queues_seq:
+            return
+
+        queues_seq, queue_list = self.shared_state.list_intervals()
+        self.queue_list = queue_list
+        self.queues_seq = queues_seq
+        self.queues_updated_at = datetime.fromtimestamp(self.shared_state.intervals_updated_at())
+        schedules = self._parse_schedules(self.queue_list)
+        changed = {
+            queue: schedule for queue, schedule in schedules.items()
+            if queue not in self.schedules or self.schedules[queue].intervals != schedule.intervals
+        }
+        # Queues gone from the snapshot have no outages anymore
+        for queue in self.schedules.keys() - schedules.keys():
+            changed[queue] = TimeIntervalsEX()
+        self.schedules = schedules
+        self.last_update_queues = now
+        logger.info(f"Synced queues list. Seq: {self.queues_seq}. Queues count: {len(self.queue_list)}. Changed schedules: {list(changed)}")
 
-# Update devices list only when new device is registered
-    def repopulate_devices(self) -> None:
-        logger.info(f"Start repopulating devices list. Devices count: {len(self.devices_list)}")
-        self.devices_list = self.repo_handler.list_devices()
-        self.last_update_devices = datetime.now()
-        logger.info(f"End repopulating devices list. Devices count: {len(self.devices_list)}")
+        if changed:
+            for listener in self.schedule_listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logger.error(f"Schedule listener failed: {e}")
+
+# Merged saved intervals per queue
+    @staticmethod
+    def _parse_schedules(queue_list: List[Dict[str, str]]) -> Dict[str, TimeIntervalsEX]:
+        schedules: Dict[str, TimeIntervalsEX] = {}
+        for record in queue_list:
+            queue = record.get("queue")
+            if not queue:
+                continue
+            try:
+                saved = json.loads(record.get("intervals") or "{}")
+            except ValueError:
+                logger.warning(f"Broken saved intervals for queue {queue}")
+                saved = {}
+            schedules[queue] = parse_intervals(saved if isinstance(saved, dict) else {}, schedules.get(queue))
+        return schedules
+
+# Expected time of the next sweep
+    def next_poll_at(self) -> datetime:
+        return self.queues_updated_at + self.poll_interval
+
+# Publish a single registered device without re-reading the whole devices list
+# Every worker (this one included) applies it on its next sync, so a burst of registrations costs one store copy
+    def upsert_device(self, device: Dict[str, str]) -> None:
+        self.shared_state.upsert_device(device)
 
 
 # Main worker
+# Caller must hold the "sweep" lease, so only one worker runs it at a time
     def seek_changes(self) -> Tuple[str, int]:
+        phases: Dict[str, float] = {}
+        phase_start = time.perf_counter()
 
+        def end_phase(name: str) -> None:
+            nonlocal phase_start
+            now = time.perf_counter()
+            phases[name] = round(now - phase_start, 4)
+            phase_start = now
+
+        # Compare against the intervals saved by whichever worker ran the previous sweep
+        self.sync(force=True)
+        end_phase("sync")
 
         # Get updated data from OblEnergo API
         logger.info(f"Start seek_changes. Queues count: {len(self.queue_list)}")
-        data_retriever = OblEnergoDataRetriever()
+        data_retriever = OblEnergoDataRetriever(self.queue_catalog)
         oblenergo_data = data_retriever.get_oblenergo_data(self.queue_list)
+        end_phase("fetch")
         logger.info(f"End oblenergo requests. Results: \n{json.dumps(oblenergo_data, indent=2)}")
 
         # Find queues that have significant changes
         logger.info(f"Start analyzing changes. Queues count: {len(self.queue_list)}")
         changed_queues = get_changes(oblenergo_data)
+        end_phase("analyze")
+
+        # Keep the new schedules of changed queues in the history
+        changed_schedules: Dict[str, TimeIntervalsEX] = {}
+        for record in oblenergo_data:
+            if record.get("queue") in changed_queues:
+                parse_intervals(record.get("oblenergo_response") or {}, changed_schedules.setdefault(record.get("queue"), TimeIntervalsEX()))
+        recorded_at = datetime.now()
+        for queue, schedule in changed_schedules.items():
+            try:
+                self.history.append(queue, schedule, recorded_at)
+            except (OSError, struct.error) as e:
+                logger.error(f"Exception while saving history for queue {queue} : {e}")
+        end_phase("history")
 
         # Save the updated responses anyway
         record: dict[str, str]
@@ -59,11 +222,15 @@ class ChangesDetector:
                 self.repo_handler.save_intervals(int(record.get("account")),record.get("queue"),record.get("oblenergo_response"))
             except Exception as e:
                 logger.error("Exception while saving intervals for queue" + record.get("queue") + f" : {e}")
-        self.queue_list = self.repo_handler.list_intervals()
+        end_phase("save")
+        self.shared_state.replace_intervals(self.repo_handler.list_intervals())
+        self.sync(force=True)
+        end_phase("publish")
 
 
         # Return changed queues and number of changed queues
         self.last_update_queues = datetime.now()
         results = (changed_queues, len(changed_queues))
-        logger.info(f"End seek_changes. Results: {results}")
+        self.last_phases = phases
+        logger.info(f"End seek_changes. Results: {results}. Phases: {phases}")
         return results
@@ -0,0 +1,248 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class DeviceStore:
+    """
+    Compact columnar in-memory devices storage.
+    Every device is a row in parallel arrays:
+      - device type and watched queue are interned to small ints
+      - push tokens are deduplicated: rows keep a token id, the token string is stored once
+      - every queue keeps its own array of rows and matching array of token ids,
+        so fan-out for a queue never scans other queues' devices
+    Upsert / delete by device_uuid are O(1); freed rows and token ids are reused.
+    The store is not thread safe: writers modify a copy() and publish it, readers never see it change.
+    """
+
+    __slots__ = (
+        "_rows", "_uuids", "_type_ids", "_queue_ids", "_token_ids", "_details", "_queue_pos", "_free_rows",
+        "_type_names", "_type_index",
+        "_queue_names", "_queue_index", "_queue_rows", "_queue_tokens",
+        "_tokens", "_token_index", "_token_refs", "_free_tokens",
+    )
+
+    # MARK: - Init / Storage
+    def __init__(self) -> None:
+        # Rows
+        self._rows: Dict[str, int] = {}
+        self._uuids: List[Optional[str]] = []
+        self._type_ids = array("B")
+        self._queue_ids = array("H")
+        self._token_ids = array("I")
+        self._details: List[Optional[str]] = []
+        self._queue_pos = array("I")
+        self._free_rows: List[int] = []
+
+        # Interned device types
+        self._type_names: List[str] = []
+        self._type_index: Dict[str, int] = {}
+
+        # Interned queues with per queue members
+        self._queue_names: List[str] = []
+        self._queue_index: Dict[str, int] = {}
+        self._queue_rows: List[array] = []
+        self._queue_tokens: List[array] = []
+
+        # Deduplicated push tokens
+        self._tokens: List[Optional[str]] = []
+        self._token_index: Dict[str, int] = {}
+        self._token_refs = array("I")
+        self._free_tokens: List[int] = []
+
+    @classmethod
+    def from_records(cls, devices: Iterable[Dict[str, str]]) -> "DeviceStore":
+        store = cls()
+        for device in devices:
+            store.upsert(device)
+        return store
+
+    def copy(self) -> "DeviceStore":
+        """Independent copy, arrays are copied with memcpy and the strings are shared."""
+        store = DeviceStore.__new__(DeviceStore)
+        store._rows = dict(self._rows)
+        store._uuids = list(self._uuids)
+        store._type_ids = self._type_ids[:]
+        store._queue_ids = self._queue_ids[:]
+        store._token_ids = self._token_ids[:]
+        store._details = list(self._details)
+        store._queue_pos = self._queue_pos[:]
+        store._free_rows = list(self._free_rows)
+        store._type_names = list(self._type_names)
+        store._type_index = dict(self._type_index)
+        store._queue_names = list(self._queue_names)
+        store._queue_index = dict(self._queue_index)
+        store._queue_rows = [rows[:] for rows in self._queue_rows]
+        store._queue_tokens = [tokens[:] for tokens in self._queue_tokens]
+        store._tokens = list(self._tokens)
+        store._token_index = dict(self._token_index)
+        store._token_refs = self._token_refs[:]
+        store._free_tokens = list(self._free_tokens)
+        return store
+
+    # MARK: - Interning
+    def _intern_type(self, device_type: str) -> int:
+        type_id = self._type_index.get(device_type)
+        if type_id is None:
+            type_id = len(self._type_names)
+            self._type_names.append(device_type)
+            self._type_index[device_type] = type_id
+        return type_id
+
+    def _intern_queue(self, queue: str) -> int:
+        queue_id = self._queue_index.get(queue)
+        if queue_id is None:
+            queue_id = len(self._queue_names)
+            self._queue_names.append(queue)
+            self._queue_index[queue] = queue_id
+            self._queue_rows.append(array("I"))
+            self._queue_tokens.append(array("I"))
+        return queue_id
+
+    def _acquire_token(self, token: str) -> int:
+        token_id = self._token_index.get(token)
+        if token_id is not None:
+            self._token_refs[token_id] += 1
+            return token_id
+
+        if self._free_tokens:
+            token_id = self._free_tokens.pop()
+            self._tokens[token_id] = token
+            self._token_refs[token_id] = 1
+        else:
+            token_id = len(self._tokens)
+            self._tokens.append(token)
+            self._token_refs.append(1)
+        self._token_index[token] = token_id
+        return token_id
+
+    def _release_token(self, token_id: int) -> None:
+        self._token_refs[token_id] -= 1
+        if self._token_refs[token_id] == 0:
+            del self._token_index[self._tokens[token_id]]
+            self._tokens[token_id] = None
+            self._free_tokens.append(token_id)
+
+    # MARK: - Queue membership
+    def _add_to_queue(self, row: int) -> None:
+        queue_id = self._queue_ids[row]
+        self._queue_pos[row] = len(self._queue_rows[queue_id])
+        self._queue_rows[queue_id].append(row)
+        self._queue_tokens[queue_id].append(self._token_ids[row])
+
+    def _remove_from_queue(self, row: int) -> None:
+        # Swap with the last member, then drop the tail
+        queue_id = self._queue_ids[row]
+        rows = self._queue_rows[queue_id]
+        tokens = self._queue_tokens[queue_id]
+        pos = self._queue_pos[row]
+        last_row = rows[-1]
+        rows[pos] = last_row
+        tokens[pos] = tokens[-1]
+        self._queue_pos[last_row] = pos
+        rows.pop()
+        tokens.pop()
+
+    # MARK: - Upsert / delete
+    def upsert(self, device: Dict[str, str]) -> None:
+        device_uuid = device["device_uuid"]
+        type_id = self._intern_type(device.get("device_type") or "")
+        queue_id = self._intern_queue(device.get("watched_queue") or "")
+        token_id = self._acquire_token(device.get("push_address") or "")
+        details = device.get("device_details") or None
+
+        row = self._rows.get(device_uuid)
+        if row is not None:
+            self._remove_from_queue(row)
+            self._release_token(self._token_ids[row])
+            self._type_ids[row] = type_id
+            self._queue_ids[row] = queue_id
+            self._token_ids[row] = token_id
+            self._details[row] = details
+        elif self._free_rows:
+            row = self._free_rows.pop()
+            self._uuids[row] = device_uuid
+            self._type_ids[row] = type_id
+            self._queue_ids[row] = queue_id
+            self._token_ids[row] = token_id
+            self._details[row] = details
+        else:
+            row = len(self._uuids)
+            self._uuids.append(device_uuid)
+            self._type_ids.append(type_id)
+            self._queue_ids.append(queue_id)
+            self._token_ids.append(token_id)
+            self._details.append(details)
+            self._queue_pos.append(0)
+
+        self._rows[device_uuid] = row
+        self._add_to_queue(row)
+
+    def delete(self, device_uuid: str) -> bool:
+        row = self._rows.pop(device_uuid, None)
+        if row is None:
+            return False
+
+        self._remove_from_queue(row)
+        self._release_token(self._token_ids[row])
+        self._uuids[row] = None
+        self._details[row] = None
+        self._free_rows.append(row)
+        return True
+
+    # MARK: - Lookup
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, device_uuid: str) -> bool:
+        return device_uuid in self._rows
+
+    def _record(self, row: int) -> Dict[str, str]:
+        return {
+            "device_uuid": self._uuids[row],
+            "device_type": self._type_names[self._type_ids[row]],
+            "push_address": self._tokens[self._token_ids[row]],
+            "watched_queue": self._queue_names[self._queue_ids[row]],
+            "device_details": self._details[row] or "",
+        }
+
+    def get(self, device_uuid: str) -> Optional[Dict[str, str]]:
+        row = self._rows.get(device_uuid)
+        return self._record(row) if row is not None else None
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        """Devices as plain dicts (same shape as SheetsRepository.list_devices), built lazily."""
+        for row in self._rows.values():
+            yield self._record(row)
+
+    # MARK: - Per queue access
+    def queue_token_ids(self, queue: str) -> memoryview:
+        """
+        Zero-copy read-only view of the queue's token ids, resolve them with token().
+        Release the view (or use it in a with block) before the store is modified,
+        arrays with exported buffers can't be resized (published stores are never modified, see copy()).
+        """
+        queue_id = self._queue_index.get(queue)
+        if queue_id is None:
+            return memoryview(array("I")).toreadonly()
+        return memoryview(self._queue_tokens[queue_id]).toreadonly()
+
+    def token(self, token_id: int) -> str:
+        return self._tokens[token_id]
+
+    def queue_tokens(self, queue: str) -> List[str]:
+        """Push tokens of the queue resolved from its token id slice, the strings themselves are not copied."""
+        tokens = self._tokens
+        with self.queue_token_ids(queue) as token_ids:
+            return [tokens[token_id] for token_id in token_ids]
+
+    def iter_queue(self, queue: str) -> Iterator[Tuple[str, str, str]]:
+        """(device_uuid, device_type, push_address) of every device watching the queue."""
+        queue_id = self._queue_index.get(queue)
+        if queue_id is None:
+            return
+        for row in self._queue_rows[queue_id]:
+            yield (
+                self._uuids[row],
+                self._type_names[self._type_ids[row]],
+                self._tokens[self._token_ids[row]],
+            )
@@ -0,0 +1,109 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ListingSnapshot:
+    """Sorted, already serialized listing. keys[i] is the cursor key of rows[i]."""
+    keys: List[str]
+    rows: List[str]
+    digest: str
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # MARK: - Cursors
+    @staticmethod
+    def encode_cursor(key: str) -> str:
+        return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> str:
+        try:
+            # validate: urlsafe_b64decode drops characters outside the alphabet, "!!!" would decode to ""
+            return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+        except (binascii.Error, UnicodeError, ValueError) as e:
+            raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+    # MARK: - Pagination
+    def page(self, cursor: Optional[str], limit: Optional[int]) -> Tuple[List[str], Optional[str]]:
+        """Rows after the cursor (all of them if limit is None) and the cursor of the next page."""
+        start = bisect_right(self.keys, self.decode_cursor(cursor)) if cursor else 0
+        end = len(self.rows) if limit is None else min(start + limit, len(self.rows))
+        next_cursor = self.encode_cursor(self.keys[end - 1]) if end < len(self.rows) else None
+        return self.rows[start:end], next_cursor
+
+    def etag(self, cursor: Optional[str], limit: Optional[int]) -> str:
+        page_id = hashlib.sha1(f"{self.digest}|{cursor}|{limit}".encode("utf-8")).hexdigest()[:20]
+        return f'"{page_id}"'
+
+    # MARK: - Streaming
+    @staticmethod
+    def stream(rows: List[str], chunk_size: int = 500) -> Iterator[bytes]:
+        """JSON array body in chunks, rows are never joined into one big string."""
+        yield b"["
+        for start in range(0, len(rows), chunk_size):
+            chunk = ",".join(rows[start:start + chunk_size])
+            yield (chunk if start == 0 else "," + chunk).encode("utf-8")
+        yield b"]"
+
+
+class ListingCache:
+    """
+    TTL cache of serialized listings, one entry per filters combination.
+    Entries are dropped when the source version changes or when they are older than ttl.
+    """
+
+    def __init__(
+            self,
+            ttl: timedelta,
+            key: Callable[[Dict[str, str]], str]):
+        self.ttl = ttl
+        self.key = key
+        self._version: Optional[int] = None
+        self._entries: Dict[Hashable, Tuple[datetime, ListingSnapshot]] = {}
+
+    def get(
+            self,
+            version: int,
+            filters: Hashable,
+            loader: Callable[[], Iterable[Dict[str, str]]]
+    ) -> ListingSnapshot:
+        now = datetime.now()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+        cached = self._entries.get(filters)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+
+        snapshot = self._build(loader())
+        self._entries[filters] = (now, snapshot)
+        logger.info(f"Listing rebuilt. Version: {version}. Filters: {filters}. Items: {len(snapshot)}")
+        return snapshot
+
+    def _build(self, items: Iterable[Dict[str, str]]) -> ListingSnapshot:
+        keyed = sorted(((self.key(item), item) for item in items), key=lambda pair: pair[0])
+        digest = hashlib.sha1()
+        keys: List[str] = []
+        rows: List[str] = []
+        for key, item in keyed:
+            row = json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+            digest.update(row.encode("utf-8"))
+            keys.append(key)
+            rows.append(row)
+        return ListingSnapshot(keys=keys, rows=rows, digest=digest.hexdigest())
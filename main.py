@@ -1,24 +1,38 @@
 from __future__ import annotations
 
+import asyncio
+import hmac
 import os
-from datetime import datetime
-from typing import Optional, Literal
-from pydantic import BaseModel, Field
+from datetime import datetime, timedelta
+from typing import Optional, Literal, Dict
+from zoneinfo import ZoneInfo
+from pydantic import BaseModel, Field, field_validator
 
 import logging
 
 import json
-from fastapi import FastAPI, status, Response, BackgroundTasks
+from fastapi import FastAPI, status, Response, BackgroundTasks, Request, Query, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 
 from fcmNotificationSender import FCMAsyncSender
 from sheetsRepository import SheetsRepository
 from changesDetector import ChangesDetector
+from sharedState import SharedStateStore
+from reminderScheduler import ReminderScheduler
+from queueCatalog import QueueCatalog
+from scheduleHistory import ScheduleHistory
+from sweepProfiler import SweepProfiler
+from timeIntervalsEx import TimeIntervalsEX
+from listingCache import ListingCache, ListingSnapshot, InvalidCursorError
 
 from firebase_admin import credentials, initialize_app
 
 # Finish imports
 
+KYIV_TZ = ZoneInfo("Europe/Kyiv")
+
 # App start timestamp
 start_time: datetime = datetime.now()
 
@@ -40,8 +54,28 @@ data_handler = SheetsRepository(
 )
 logger.info(f"[main] Connected to google storage")
 
+# Connect to state shared between workers
+logger.info(f"[main] Connecting to shared state")
+shared_state = SharedStateStore(path_env_key="SHARED_STATE_PATH")
+SWEEP_LEASE_SECONDS = float(os.getenv("SWEEP_LEASE_SECONDS", "300"))
+logger.info(f"[main] Connected to shared state")
+
+logger.info(f"[main] Loading queue catalog")
+queue_catalog = QueueCatalog(path_env_key="QUEUE_CATALOG_PATH")
+logger.info(f"[main] Loaded queue catalog")
+
+logger.info(f"[main] Opening schedule history")
+schedule_history = ScheduleHistory(path_env_key="SCHEDULE_HISTORY_PATH")
+logger.info(f"[main] Opened schedule history")
+
 logger.info(f"[main] Start downloading saved data")
-changes_detector = ChangesDetector(data_handler)
+changes_detector = ChangesDetector(
+    data_handler,
+    shared_state,
+    queue_catalog,
+    schedule_history,
+    poll_interval=timedelta(seconds=float(os.getenv("POLL_INTERVAL_SECONDS", "600"))),
+)
 changes_detector.populate()
 logger.info(f"[main] End downloading saved data")
 
@@ -52,6 +86,48 @@ sender = FCMAsyncSender(
 )
 logger.info(f"[main] FCMAsyncSender started successfully")
 
+logger.info(f"[main] Start ReminderScheduler")
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "30"))
+reminder_sender = FCMAsyncSender(
+    fixed_title="Outage soon!",
+    fixed_body=f"Power outage for your watched queue starts in {REMINDER_LEAD_MINUTES} minutes",
+)
+
+
+async def remind_queue(queue: str, interval: TimeIntervalsEX.Interval) -> None:
+    # The heap of an idle worker may be behind the last sweep: skip outages that were cancelled or moved.
+    # Matched by start like the lease key, an outage whose end changed is still due
+    await run_in_threadpool(changes_detector.sync, True)
+    queue_schedule = changes_detector.schedules.get(queue)
+    if queue_schedule is None or not any(scheduled.start == interval.start for scheduled in queue_schedule.intervals):
+        logger.info(f"[reminders] Outage of queue {queue} at {interval.start} is no longer scheduled, skipping")
+        return
+
+    # Every worker keeps the same reminders, the one that takes the lease sends them
+    lease_ttl = max((interval.start - datetime.now(KYIV_TZ)).total_seconds(), 0) + 3600
+    if not shared_state.try_acquire_lease(f"reminder:{queue}:{interval.start.isoformat()}", ttl_seconds=lease_ttl):
+        return
+    shared_state.purge_expired_leases()
+
+    devices_store = changes_detector.devices
+    push_addresses = devices_store.queue_tokens(queue)
+    for push_address in push_addresses:
+        await reminder_sender.enqueue_token(push_address)
+    logger.info(f"[reminders] Queued reminders for queue {queue} outage at {interval.start}: {len(push_addresses)} devices")
+
+
+def reschedule_reminders(changed: Dict[str, TimeIntervalsEX]) -> None:
+    for queue, schedule in changed.items():
+        reminder_scheduler.reschedule(queue, schedule)
+
+
+reminder_scheduler = ReminderScheduler(lead=timedelta(minutes=REMINDER_LEAD_MINUTES), on_due=remind_queue)
+changes_detector.schedule_listeners.append(reschedule_reminders)
+reschedule_reminders(changes_detector.schedules)
+logger.info(f"[main] ReminderScheduler started successfully. Reminders: {len(reminder_scheduler)}")
+
+profiler = SweepProfiler(shared_state, keep=int(os.getenv("PROFILES_KEEP", "20")))
+
 logger.info(f"[main] Service is up and running")
 
 # Start App
@@ -64,6 +140,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
 # Initialize FCAsync Sender on startup
 
 @app.on_event("startup")
@@ -79,34 +156,193 @@ async def startup():
         cred = credentials.Certificate("service_account.json")
     initialize_app(cred)
     await sender.start()
+    await reminder_sender.start()
+    await reminder_scheduler.start()
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    await reminder_scheduler.stop()
+    await reminder_sender.stop()
     await sender.stop()
 
 
 # Default GETs
+# Sync endpoints wrapped with @profiler.profiled() are profiled when armed through /admin/profiling
 @app.get("/")
 async def root():
     logger.info(f"[root] response: \"Running since {start_time}\"")
     return {"message": f"Running since {start_time}"}
 
 
+LISTING_CACHE_TTL = timedelta(seconds=float(os.getenv("LISTING_CACHE_TTL_SECONDS", "30")))
+devices_cache = ListingCache(ttl=LISTING_CACHE_TTL, key=lambda device: device["device_uuid"])
+intervals_cache = ListingCache(ttl=LISTING_CACHE_TTL, key=lambda record: f"{record['queue']}|{record['account']}")
+
+
+def listing_response(
+        name: str,
+        request: Request,
+        snapshot: ListingSnapshot,
+        cursor: Optional[str],
+        limit: Optional[int]) -> Response:
+    etag = snapshot.etag(cursor, limit)
+    if etag in request.headers.get("if-none-match", ""):
+        logger.info(f"[{name}] response: not modified, etag {etag}")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    try:
+        rows, next_cursor = snapshot.page(cursor, limit)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    logger.info(f"[{name}] response: {len(rows)} of {len(snapshot)} items, next cursor: {next_cursor}, etag {etag}")
+    return StreamingResponse(ListingSnapshot.stream(rows), media_type="application/json", headers=headers)
+
+
+# Served from the in-memory state. Without limit the whole list is returned,
+# with limit the next page is requested with the X-Next-Cursor response header value
 @app.get("/devices")
-def devices():
-    items_list = data_handler.list_devices()
-    json_string: str = json.dumps(items_list, indent=2)
-    logger.info(f"[devices] response: \"{json_string}\"")
-    return Response(content=json_string, media_type="application/json")
+@profiler.profiled()
+def devices(
+        request: Request,
+        watched_queue: Optional[str] = None,
+        device_type: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=1000)):
+    changes_detector.sync()
+    # Take the store once, sync() in other threads replaces it
+    devices_seq = changes_detector.devices_seq
+    devices_store = changes_detector.devices
+    snapshot = devices_cache.get(
+        devices_seq,
+        (watched_queue, device_type),
+        lambda: (
+            device for device in devices_store
+            if (watched_queue is None or device["watched_queue"] == watched_queue)
+            and (device_type is None or device["device_type"] == device_type)
+        ),
+    )
+    return listing_response("devices", request, snapshot, cursor, limit)
 
 
 @app.get("/intervals")
-def intervals():
-    items_list = data_handler.list_intervals()
-    json_string: str = json.dumps(items_list, indent=2)
-    logger.info(f"[intervals] response: \"{json_string}\"")
-    return Response(content=json_string, media_type="application/json")
+@profiler.profiled()
+def intervals(
+        request: Request,
+        queue: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=1000)):
+    changes_detector.sync()
+    queues_seq = changes_detector.queues_seq
+    queue_list = changes_detector.queue_list
+    snapshot = intervals_cache.get(
+        queues_seq,
+        queue,
+        lambda: (
+            record for record in queue_list
+            if queue is None or record["queue"] == queue
+        ),
+    )
+    return listing_response("intervals", request, snapshot, cursor, limit)
+
+
+# Schedules (queue ids contain slashes, they are passed as the rest of the path: /schedule/3/2)
+
+def schedule_for(queue: str, response: Response) -> TimeIntervalsEX:
+    changes_detector.sync()
+    queue_schedule = changes_detector.schedules.get(queue)
+    if queue_schedule is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown queue: {queue}")
+
+    set_cache_control(response)
+    return queue_schedule
+
+
+def set_cache_control(response: Response, valid_until: Optional[datetime] = None) -> None:
+    # Nothing changes until the next sweep (or valid_until, if it comes first)
+    max_age = (changes_detector.next_poll_at() - datetime.now()).total_seconds()
+    if valid_until is not None:
+        max_age = min(max_age, (valid_until - datetime.now(KYIV_TZ)).total_seconds())
+    response.headers["Cache-Control"] = f"public, max-age={max(int(max_age), 0)}"
+
+
+def interval_to_dict(interval: Optional[TimeIntervalsEX.Interval]) -> Optional[Dict[str, str]]:
+    if interval is None:
+        return None
+    return {"start": interval.start.isoformat(), "end": interval.end.isoformat()}
+
+
+# Declared before /schedule/{queue:path}, which would match ".../at" as part of the queue
+@app.get("/schedule/{queue:path}/at")
+@profiler.profiled()
+def schedule_at(queue: str, response: Response, ts: Optional[datetime] = None):
+    queue_schedule = schedule_for(queue, response)
+    relative_to_now = ts is None
+    if ts is None:
+        ts = datetime.now(KYIV_TZ)
+    elif ts.tzinfo is None:
+        ts = ts.replace(tzinfo=KYIV_TZ)
+
+    interval = queue_schedule.interval_containing(ts)
+    next_interval = queue_schedule.next_interval(ts)
+    if relative_to_now:
+        # The answer for "now" flips at the next interval boundary
+        boundary = interval.end if interval is not None else (next_interval.start if next_interval else None)
+        set_cache_control(response, valid_until=boundary)
+    logger.info(f"[scheduleAt] response: {queue} at {ts}: {interval}")
+    return {
+        "queue": queue,
+        "ts": ts.isoformat(),
+        "is_off": interval is not None,
+        "interval": interval_to_dict(interval),
+        "next_interval": interval_to_dict(next_interval),
+    }
+
+
+@app.get("/schedule/{queue:path}")
+@profiler.profiled()
+def schedule(queue: str, response: Response):
+    queue_schedule = schedule_for(queue, response)
+    logger.info(f"[schedule] response: {queue} {queue_schedule.pretty_print(False)}")
+    return {
+        "queue": queue,
+        "updated_at": changes_detector.queues_updated_at.isoformat(),
+        "intervals": [interval_to_dict(interval) for interval in queue_schedule.intervals],
+        "pretty": queue_schedule.pretty_print(True),
+    }
+
+
+@app.get("/history/{queue:path}")
+@profiler.profiled()
+def history(
+        queue: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None):
+    until = until or datetime.now(KYIV_TZ)
+    since = since or until - timedelta(days=7)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=KYIV_TZ)
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=KYIV_TZ)
+
+    changes = schedule_history.changes(queue, since, until)
+    logger.info(f"[history] response: {queue} from {since} to {until}: {len(changes)} changes")
+    return {
+        "queue": queue,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "changes": [
+            {
+                "recorded_at": recorded_at.isoformat(),
+                "intervals": [interval_to_dict(interval) for interval in intervals],
+            }
+            for recorded_at, intervals in changes
+        ],
+    }
 
 
 # This is where it becomes interesting
@@ -117,33 +353,113 @@ class RegisterDeviceRequest(BaseModel):
     device_uuid: str = Field(..., min_length=1)
     device_type: Literal["IOS", "ANDROID", "WEB"] = Field(..., min_length=1)
     push_address: str = Field(..., min_length=1)
-    watched_queue: Literal["1/1", "1/2", "2/1", "2/2", "3/1", "3/2", "4/1", "4/2", "5/1", "5/2", "6/1", "6/2",] = Field(
-        ..., min_length=1)
+    watched_queue: str = Field(..., min_length=1)
     device_details: Optional[str] = None
 
+    @field_validator("watched_queue")
+    @classmethod
+    def watched_queue_in_catalog(cls, value: str) -> str:
+        if value not in queue_catalog:
+            raise ValueError(f"Unknown queue {value}, expected one of: {', '.join(queue_catalog.queues)}")
+        return value
+
 
 @app.post("/registerDevice")
-async def register_device(body: RegisterDeviceRequest):
+@profiler.profiled()
+def register_device(body: RegisterDeviceRequest):
     logger.info(f"[registerDevice] request: \"{body}\"")
     data_handler.save_device(**body.model_dump())
-    changes_detector.repopulate_devices()
+    changes_detector.upsert_device(body.model_dump())
     return {"message": "Device saved"}
 
 
 # Worker request (should be triggered externally every N minutes)
 
+# One sweep per process at a time, the shared lease covers the other workers
+sweep_lock = asyncio.Lock()
+
+
+async def renew_sweep_lease() -> None:
+    # The lease must outlive the sweep however long polling takes, renew it while the sweep runs
+    while True:
+        await asyncio.sleep(SWEEP_LEASE_SECONDS / 3)
+        if not shared_state.try_acquire_lease("sweep", ttl_seconds=SWEEP_LEASE_SECONDS):
+            logger.error("[checkChanges] Sweep lease was taken by another worker")
+
+
+def run_sweep():
+    with profiler.profile("sweep", "/checkChanges") as tags:
+        results = changes_detector.seek_changes()
+        tags.update(changes_detector.last_phases)
+    return results
+
+
 @app.get("/checkChanges")
 async def check_changes(bg: BackgroundTasks):
     logger.info("[checkChanges] Triggered")
-    results = changes_detector.seek_changes()
+    # Only one worker sweeps per tick, the rest skip
+    if sweep_lock.locked() or not shared_state.try_acquire_lease("sweep", ttl_seconds=SWEEP_LEASE_SECONDS):
+        logger.info("[checkChanges] Sweep is already running, skipping")
+        return {"result": "Skipped", "detected_changes": [], "pushes_scheduled": 0}
+    async with sweep_lock:
+        renewal = asyncio.create_task(renew_sweep_lease())
+        try:
+            # Off the event loop, so this worker keeps serving requests during the sweep
+            results = await run_in_threadpool(run_sweep)
+        finally:
+            renewal.cancel()
+            shared_state.release_lease("sweep")
     logger.info("[checkChanges] Check devices for changed queues")
     queued_notifications = 0
+    devices_store = changes_detector.devices
     for queue in results[0]:
-        logger.info(f"[checkChanges] Devices for queue {queue}")
-        for device in changes_detector.devices_list:
-            if device["watched_queue"] == queue:
-                bg.add_task(sender.enqueue_token, device["push_address"])
-                logger.info(f"[checkChanges] Queued notification for {device['device_type']} {device['device_uuid']}")
-                queued_notifications += 1
+        push_addresses = devices_store.queue_tokens(queue)
+        for push_address in push_addresses:
+            bg.add_task(sender.enqueue_token, push_address)
+        logger.info(f"[checkChanges] Queued notifications for queue {queue}: {len(push_addresses)} devices")
+        queued_notifications += len(push_addresses)
     logger.info(f"[checkChanges] Queued notifications for {queued_notifications} devicess")
     return {"result": "Success", "detected_changes": results[0], "pushes_scheduled": queued_notifications}
+
+
+# Admin (X-Admin-Token header must match ADMIN_TOKEN env, disabled when it's not set)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+class ProfilingRequest(BaseModel):
+    sweeps: int = Field(0, ge=0, le=100)
+    requests: int = Field(0, ge=0, le=1000)
+
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+def arm_profiling(body: ProfilingRequest):
+    logger.info(f"[adminProfiling] request: \"{body}\"")
+    profiler.arm("sweep", body.sweeps)
+    profiler.arm("request", body.requests)
+    return {"sweeps": body.sweeps, "requests": body.requests}
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def profiles():
+    items_list = shared_state.list_profiles()
+    logger.info(f"[adminProfiles] response: {len(items_list)} profiles")
+    return items_list
+
+
+# pstats file by default (load with pstats.Stats(path)), ?format=text for the top functions summary
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def profile_download(profile_id: int, format: Literal["pstats", "text"] = "pstats"):
+    profile = shared_state.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown profile: {profile_id}")
+
+    logger.info(f"[adminProfile] response: profile {profile_id} as {format}")
+    headers = {"X-Profile-Tags": json.dumps(profile["tags"])}
+    if format == "text":
+        return Response(content=profile["summary"], media_type="text/plain", headers=headers)
+    headers["Content-Disposition"] = f"attachment; filename=profile-{profile_id}-{profile['kind']}.pstats"
+    return Response(content=profile["stats"], media_type="application/octet-stream", headers=headers)
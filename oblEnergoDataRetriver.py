@@ -1,43 +1,58 @@
 from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 import requests
 import certifi
 import ssl
 import urllib3
+import threading
 import time
 import random
 from requests.exceptions import SSLError
 
+from providers import Provider
+from queueCatalog import QueueCatalog
+
 logger = logging.getLogger(__name__)
 
 
+class _RateLimiter:
+    """
+    Keeps min_request_interval + random jitter between requests of one provider:
+    after every response (as the sequential poller slept after each request) and between request starts.
+    """
+
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def _delay(self) -> float:
+        return self.provider.min_request_interval + round(random.random() * self.provider.request_jitter, 3)
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._delay()
+        if start > now:
+            time.sleep(start - now)
+
+    def finished(self) -> None:
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + self._delay())
+
+
 class OblEnergoDataRetriever:
+    """
+    Polls every account of the queue list.
+    Accounts are sharded by provider (resolved with the queue catalog), every shard runs in parallel
+    with its own concurrency limit and rate budget, so a slow provider doesn't delay the others.
+    """
 
-    URL = "https://interruptions.energy.cn.ua/api/info_disable"
-
-    HEADERS = {
-        "Content-Type": "application/json",
-        "Accept": "*/*",
-        "Accept-Language": "uk",
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "Origin": "https://interruptions.energy.cn.ua",
-        "Pragma": "no-cache",
-        "Referer": "https://interruptions.energy.cn.ua/interruptions",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-Storage-Access": "none",
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/143.0.0.0 Safari/537.36"
-        ),
-        "sec-ch-ua": '"Google Chrome";v="143", "Chromium";v="143", "Not A(Brand";v="24"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"macOS"',
-    }
+    def __init__(self, queue_catalog: QueueCatalog):
+        self.queue_catalog = queue_catalog
 
     def get_oblenergo_data(
             self,
@@ -49,72 +64,94 @@ class OblEnergoDataRetriever:
         logger.info(f"Default verify paths: {ssl.get_default_verify_paths()}")
         logger.info(f"Certifi: {certifi.where()}")
 
-        results: List[Dict[str, str]] = []
-
+        shards: Dict[str, Tuple[Provider, List[Dict[str, str]]]] = {}
         for record in queue_list:
-            account = record.get("account")
-
-            if not account:
+            if not record.get("account"):
                 logger.warning("Missing account field", extra={"record": record})
                 continue
 
-            payload = {"person_accnt": account}
-            logger.info(f"Start request for account: {account}")
-
-            try:
-                response = requests.post(
-                    self.URL,
-                    json=payload,
-                    headers=self.HEADERS,
-                    timeout=10,
-                    verify=certifi.where()
-                )
+            provider = self.queue_catalog.provider_for(record.get("queue"))
+            shards.setdefault(provider.name, (provider, []))[1].append(record)
 
-                response.raise_for_status()
+        results: List[Dict[str, str]] = []
+        if not shards:
+            return results
 
-                data = response.json()
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="provider") as executor:
+            for shard_results in executor.map(lambda shard: self._poll_provider(*shard), shards.values()):
+                results.extend(shard_results)
 
-                results.append({
-                    **record,
-                    "oblenergo_response": data,
-                })
+        return results
 
-                logger.info(f"End request for account: {account}. Response: {response} \n Data: {data}")
+    def _poll_provider(
+            self,
+            provider: Provider,
+            records: List[Dict[str, str]]
+    ) -> List[Dict[str, str]]:
+        logger.info(f"Start polling {provider.name}. Accounts count: {len(records)}")
+        rate_limiter = _RateLimiter(provider)
 
-            except SSLError as ssl_exc:
-                try:
-                    logger.warning(f"SSL error: {ssl_exc}")
-                    logger.warning("Retrying with verify=False")
-                    response = requests.post(
-                        self.URL,
-                        json=payload,
-                        headers=self.HEADERS,
-                        timeout=10,
-                        verify=False
-                    )
+        def poll(record: Dict[str, str]) -> Optional[Dict[str, str]]:
+            rate_limiter.wait()
+            try:
+                return self._request_account(provider, record)
+            finally:
+                rate_limiter.finished()
 
-                    response.raise_for_status()
+        with ThreadPoolExecutor(max_workers=provider.max_concurrency, thread_name_prefix=provider.name) as executor:
+            results = [result for result in executor.map(poll, records) if result is not None]
 
-                    data = response.json()
+        logger.info(f"End polling {provider.name}. Results count: {len(results)}")
+        return results
 
-                    results.append({
-                        **record,
-                        "oblenergo_response": data,
-                    })
+    def _post(
+            self,
+            provider: Provider,
+            account: str,
+            verify
+    ) -> Dict:
+        response = requests.post(
+            provider.url,
+            json=provider.payload(account),
+            headers=provider.headers,
+            timeout=provider.timeout,
+            verify=verify
+        )
+
+        response.raise_for_status()
+
+        data = response.json()
+        logger.info(f"Response for account: {account}. Response: {response} \n Data: {data}")
+        return data
+
+    def _request_account(
+            self,
+            provider: Provider,
+            record: Dict[str, str]
+    ) -> Optional[Dict[str, str]]:
+        account = record.get("account")
+        logger.info(f"Start request for account: {account}")
 
-                    logger.info(f"End ssl-fallback request for account: {account}. Response: {response} \n Data: {data}")
+        try:
+            data = self._post(provider, account, verify=certifi.where())
+            logger.info(f"End request for account: {account}")
 
-                except requests.RequestException as exc:
-                    logger.error(f"SSL-fallback noverify request failed for account: {account}. Error: {str(exc)}")
+        except SSLError as ssl_exc:
+            try:
+                logger.warning(f"SSL error: {ssl_exc}")
+                logger.warning("Retrying with verify=False")
+                data = self._post(provider, account, verify=False)
+                logger.info(f"End ssl-fallback request for account: {account}")
 
             except requests.RequestException as exc:
-                logger.error(f"Request failed for account: {account}. Error: {str(exc)}")
-            '''
-                results.append({
-                    **record,
-                    "error": str(exc),
-                })
-            '''
-            time.sleep(1 + round(random.random(), 3))
+                logger.error(f"SSL-fallback noverify request failed for account: {account}. Error: {str(exc)}")
+                return None
 
-        return results
+        except requests.RequestException as exc:
+            logger.error(f"Request failed for account: {account}. Error: {str(exc)}")
+            return None
+
+        return {
+            **record,
+            "oblenergo_response": provider.unwrap(data),
+        }
@@ -1,12 +1,40 @@
 import json
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from timeIntervalsEx import TimeIntervalsEX
 
 logger = logging.getLogger(__name__)
 
 
+# Provider response unwrappers
+# Every provider response is converted to the energy.cn.ua format before it is saved or compared:
+# {"aData": [{"acc_begin": "dd-mm-YYYY HH:MM", "accend_plan": "dd-mm-YYYY HH:MM"}, ...]}
+
+def unwrap_energy_cn_ua(data: Dict[str, Any]) -> Dict[str, Any]:
+    return data
+
+
+def parse_intervals(
+        data: Dict[str, Any],
+        into: Optional[TimeIntervalsEX] = None
+) -> TimeIntervalsEX:
+    intervals = into if into is not None else TimeIntervalsEX()
+
+    items = data.get("aData", []) or []
+    if not isinstance(items, list):
+        return intervals
+
+    for item in items:
+        start = item.get("acc_begin")
+        end = item.get("accend_plan")
+
+        if start and end:
+            intervals.append((start, end))
+
+    return intervals
+
+
 def get_changes(raw: List[Dict[str, Any]]) -> List[str]:
 
     changed_queues = []
@@ -25,21 +53,7 @@ def get_changes(raw: List[Dict[str, Any]]) -> List[str]:
         if not account or not isinstance(response_data, list):
             continue
 
-        record = [account, queue, TimeIntervalsEX(), TimeIntervalsEX()]
-
-        for item in saved_data:
-            start = item.get("acc_begin")
-            end = item.get("accend_plan")
-
-            if start and end:
-                record[2].append((start, end))
-
-        for item in response_data:
-            start = item.get("acc_begin")
-            end = item.get("accend_plan")
-
-            if start and end:
-                record[3].append((start, end))
+        record = [account, queue, parse_intervals(saved), parse_intervals(response)]
 
         logger.info(f"Comparison record: Account:{record[0]} Queue:{record[1]} Saved data: {record[2].pretty_print(False)} Response data: {record[3].pretty_print(False)}")
 
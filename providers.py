@@ -0,0 +1,58 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict
+
+from oblEnergoResponseUnwrapper import unwrap_energy_cn_ua
+
+
+@dataclass(frozen=True)
+class Provider:
+    """Regional oblenergo API that is polled for outage schedules."""
+    name: str
+    url: str
+    # Converts the API json to the saved format (see oblEnergoResponseUnwrapper)
+    unwrap: Callable[[Dict[str, Any]], Dict[str, Any]]
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Build the request json for an account number
+    payload: Callable[[str], Dict[str, Any]] = lambda account: {"person_accnt": account}
+    # Rate budget: parallel requests and delay after every response and between request starts (+ random jitter)
+    max_concurrency: int = 1
+    min_request_interval: float = 1.0
+    request_jitter: float = 1.0
+    timeout: float = 10
+
+
+ENERGY_CN_UA = Provider(
+    name="energy_cn_ua",
+    url="https://interruptions.energy.cn.ua/api/info_disable",
+    unwrap=unwrap_energy_cn_ua,
+    headers={
+        "Content-Type": "application/json",
+        "Accept": "*/*",
+        "Accept-Language": "uk",
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "Origin": "https://interruptions.energy.cn.ua",
+        "Pragma": "no-cache",
+        "Referer": "https://interruptions.energy.cn.ua/interruptions",
+        "Sec-Fetch-Dest": "empty",
+        "Sec-Fetch-Mode": "cors",
+        "Sec-Fetch-Site": "same-origin",
+        "Sec-Fetch-Storage-Access": "none",
+        "User-Agent": (
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/143.0.0.0 Safari/537.36"
+        ),
+        "sec-ch-ua": '"Google Chrome";v="143", "Chromium";v="143", "Not A(Brand";v="24"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"macOS"',
+    },
+)
+
+# Registry of known providers, referenced by name from the queue catalog
+PROVIDERS: Dict[str, Provider] = {
+    provider.name: provider
+    for provider in (ENERGY_CN_UA,)
+}
+
+DEFAULT_PROVIDER = ENERGY_CN_UA.name
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from providers import PROVIDERS, DEFAULT_PROVIDER, Provider
+
+logger = logging.getLogger(__name__)
+
+
+class QueueCatalog:
+    """
+    Queues devices can watch and the provider that serves each of them.
+    Loaded from a json file: {"queues": [{"queue": "1/1", "provider": "energy_cn_ua"}, ...]}
+    Account numbers polled for every queue stay in the Intervals sheet.
+    """
+
+    DEFAULT_PATH = "queue_catalog.json"
+
+    def __init__(
+        self,
+        path_env_key: str = "QUEUE_CATALOG_PATH",
+        path: Optional[str] = None,
+    ) -> None:
+        self.path = path or os.getenv(path_env_key) or self.DEFAULT_PATH
+
+        with open(self.path, encoding="utf-8") as file:
+            entries = json.load(file).get("queues", [])
+
+        self._providers: Dict[str, str] = {}
+        for entry in entries:
+            queue = entry["queue"]
+            provider = entry.get("provider") or DEFAULT_PROVIDER
+            if provider not in PROVIDERS:
+                raise ValueError(f"Unknown provider {provider} for queue {queue} in {self.path}")
+            if queue in self._providers:
+                raise ValueError(f"Duplicate queue {queue} in {self.path}")
+            self._providers[queue] = provider
+
+        logger.info(f"Queue catalog loaded from {self.path}. Queues count: {len(self._providers)}")
+
+    def __contains__(self, queue: str) -> bool:
+        return queue in self._providers
+
+    @property
+    def queues(self) -> List[str]:
+        return list(self._providers)
+
+    def provider_for(self, queue: str) -> Provider:
+        provider = self._providers.get(queue)
+        if provider is None:
+            logger.warning(f"Queue {queue} is not in the catalog, using {DEFAULT_PROVIDER}")
+            provider = DEFAULT_PROVIDER
+        return PROVIDERS[provider]
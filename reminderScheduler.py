@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from timeIntervalsEx import TimeIntervalsEX
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderScheduler:
+    """
+    Fires on_due(queue, interval) `lead` before every upcoming outage start.
+    Reminders are kept in a min-heap keyed by fire time:
+      - reschedule(queue) bumps the queue generation and pushes its new reminders, O(k log n)
+      - entries of older generations are skipped when popped (lazy deletion)
+      - the worker sleeps until the earliest reminder, no periodic rescans
+    reschedule() may be called from any thread.
+    """
+
+    # (fire_at, tie breaker, queue, generation, interval)
+    _Entry = Tuple[float, int, str, int, TimeIntervalsEX.Interval]
+
+    def __init__(
+            self,
+            lead: timedelta,
+            on_due: Callable[[str, TimeIntervalsEX.Interval], Awaitable[None]]):
+        self.lead = lead
+        self.on_due = on_due
+        self._heap: List[ReminderScheduler._Entry] = []
+        self._generations: Dict[str, int] = {}
+        self._live: Dict[str, int] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def __len__(self) -> int:
+        return sum(self._live.values())
+
+    # MARK: - Scheduling
+    def reschedule(self, queue: str, schedule: TimeIntervalsEX) -> None:
+        now = time.time()
+        with self._lock:
+            generation = self._generations.get(queue, 0) + 1
+            self._generations[queue] = generation
+            earliest = self._heap[0][0] if self._heap else None
+
+            live = 0
+            for interval in schedule.intervals:
+                fire_at = (interval.start - self.lead).timestamp()
+                if fire_at <= now:
+                    continue
+                heapq.heappush(self._heap, (fire_at, next(self._counter), queue, generation, interval))
+                live += 1
+            self._live[queue] = live
+
+            # Drop stale entries once they outnumber the live ones, keeps the heap O(live)
+            if len(self._heap) > 2 * sum(self._live.values()) + 64:
+                self._heap = [entry for entry in self._heap if self._generations[entry[2]] == entry[3]]
+                heapq.heapify(self._heap)
+
+            new_earliest = bool(self._heap) and (earliest is None or self._heap[0][0] < earliest)
+
+        logger.info(f"Rescheduled reminders for queue {queue}: {live} upcoming")
+        if new_earliest and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now: float) -> Tuple[List[Tuple[str, TimeIntervalsEX.Interval]], Optional[float]]:
+        due: List[Tuple[str, TimeIntervalsEX.Interval]] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, queue, generation, interval = heapq.heappop(self._heap)
+                if self._generations.get(queue) != generation:
+                    continue
+                self._live[queue] -= 1
+                due.append((queue, interval))
+            next_fire_at = self._heap[0][0] if self._heap else None
+        return due, next_fire_at
+
+    # MARK: - Worker
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            due, next_fire_at = self._pop_due(time.time())
+
+            for queue, interval in due:
+                try:
+                    await self.on_due(queue, interval)
+                except Exception as e:
+                    logger.error(f"Reminder for queue {queue} at {interval.start} failed: {e}")
+
+            timeout = max(next_fire_at - time.time(), 0) if next_fire_at is not None else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
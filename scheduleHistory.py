@@ -0,0 +1,170 @@
+import logging
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from timeIntervalsEx import TimeIntervalsEX
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleHistory:
+    """
+    Append-only local history of schedule changes, one record per changed queue per sweep.
+    Record layout (little endian, fixed width):
+      header:  magic "SH" | recorded_at minute u32 | base minute u32 | queue length u8 | intervals count u16
+      payload: queue utf-8 | per interval: (start - previous end) u32, (end - start) u32
+    Minutes are counted from the unix epoch, the first start is relative to the base minute.
+    A per queue time index (recorded minutes + file offsets) is kept in memory and extended
+    from the file tail, so records appended by another worker are picked up on the next query.
+    """
+
+    DEFAULT_PATH = "schedule_history.bin"
+
+    _MAGIC = b"SH"
+    _HEADER = struct.Struct("<2sIIBH")
+    _DELTA = struct.Struct("<II")
+    _KYIV_TZ = ZoneInfo("Europe/Kyiv")
+
+    def __init__(
+        self,
+        path_env_key: str = "SCHEDULE_HISTORY_PATH",
+        path: Optional[str] = None,
+    ) -> None:
+        self.path = path or os.getenv(path_env_key) or self.DEFAULT_PATH
+        self._lock = threading.Lock()
+        # queue -> (recorded minutes, record offsets), both sorted by recorded minute
+        self._index: Dict[str, Tuple[array, array]] = {}
+        self._indexed_size = 0
+
+        with self._lock:
+            self._refresh_index()
+        logger.info(f"Schedule history at {self.path}. Records count: {self.records_count()}")
+
+    def records_count(self) -> int:
+        return sum(len(minutes) for minutes, _ in self._index.values())
+
+    # MARK: - Encoding
+    @staticmethod
+    def _to_minute(date: datetime) -> int:
+        return int(date.timestamp()) // 60
+
+    def _from_minute(self, minute: int) -> datetime:
+        return datetime.fromtimestamp(minute * 60, self._KYIV_TZ)
+
+    def _encode(self, queue: str, schedule: TimeIntervalsEX, recorded_at: datetime) -> bytes:
+        queue_bytes = queue.encode("utf-8")
+        intervals = schedule.intervals
+        base = self._to_minute(intervals[0].start) if intervals else 0
+
+        payload = bytearray(self._HEADER.pack(
+            self._MAGIC, self._to_minute(recorded_at), base, len(queue_bytes), len(intervals)
+        ))
+        payload += queue_bytes
+
+        # Merged intervals are sorted and don't overlap, so every delta is non negative
+        previous = base
+        for interval in intervals:
+            start = self._to_minute(interval.start)
+            end = self._to_minute(interval.end)
+            payload += self._DELTA.pack(start - previous, end - start)
+            previous = end
+        return bytes(payload)
+
+    def _decode_intervals(self, base: int, count: int, data: bytes) -> List[TimeIntervalsEX.Interval]:
+        intervals: List[TimeIntervalsEX.Interval] = []
+        previous = base
+        for gap, duration in self._DELTA.iter_unpack(data[:count * self._DELTA.size]):
+            start = previous + gap
+            previous = start + duration
+            intervals.append(TimeIntervalsEX.Interval(
+                start=self._from_minute(start),
+                end=self._from_minute(previous),
+            ))
+        return intervals
+
+    # MARK: - Index
+    def _refresh_index(self) -> None:
+        """Index records appended after the last refresh. Caller holds the lock."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= self._indexed_size:
+            return
+
+        with open(self.path, "rb") as file:
+            file.seek(self._indexed_size)
+            offset = self._indexed_size
+            while True:
+                header = file.read(self._HEADER.size)
+                if len(header) < self._HEADER.size:
+                    break
+                magic, recorded_minute, _, queue_length, count = self._HEADER.unpack(header)
+                if magic != self._MAGIC:
+                    logger.error(f"Broken schedule history record at offset {offset}, stop indexing")
+                    break
+                queue = file.read(queue_length)
+                payload_size = count * self._DELTA.size
+                if len(queue) < queue_length or offset + self._HEADER.size + queue_length + payload_size > size:
+                    # Record is still being written
+                    break
+                file.seek(payload_size, os.SEEK_CUR)
+
+                minutes, offsets = self._index.setdefault(queue.decode("utf-8"), (array("I"), array("Q")))
+                # Records are appended in time order, keep the arrays sorted if clocks went back
+                position = bisect_right(minutes, recorded_minute)
+                minutes.insert(position, recorded_minute)
+                offsets.insert(position, offset)
+
+                offset += self._HEADER.size + queue_length + payload_size
+            self._indexed_size = offset
+
+    # MARK: - Append
+    def append(self, queue: str, schedule: TimeIntervalsEX, recorded_at: datetime) -> None:
+        if len(queue.encode("utf-8")) > 0xFF or len(schedule.intervals) > 0xFFFF:
+            logger.error(f"Queue {queue} doesn't fit a schedule history record, not saved")
+            return
+        record = self._encode(queue, schedule, recorded_at)
+        # Single write on an O_APPEND descriptor, a reader never sees a record split by another writer
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+
+    # MARK: - Range query
+    def changes(
+            self,
+            queue: str,
+            since: datetime,
+            until: datetime
+    ) -> List[Tuple[datetime, List[TimeIntervalsEX.Interval]]]:
+        """Schedules recorded for the queue within [since, until], oldest first."""
+        with self._lock:
+            self._refresh_index()
+            indexed = self._index.get(queue)
+            if indexed is None:
+                return []
+            minutes, offsets = indexed
+            first = bisect_left(minutes, self._to_minute(since))
+            last = bisect_right(minutes, self._to_minute(until))
+            selected = [(minutes[i], offsets[i]) for i in range(first, last)]
+
+        results: List[Tuple[datetime, List[TimeIntervalsEX.Interval]]] = []
+        if not selected:
+            return results
+
+        with open(self.path, "rb") as file:
+            for recorded_minute, offset in selected:
+                file.seek(offset)
+                _, _, base, queue_length, count = self._HEADER.unpack(file.read(self._HEADER.size))
+                file.seek(queue_length, os.SEEK_CUR)
+                intervals = self._decode_intervals(base, count, file.read(count * self._DELTA.size))
+                results.append((self._from_minute(recorded_minute), intervals))
+        return results
@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateStore:
+    """
+    Cross-process state shared by all uvicorn workers.
+    Backed by a local SQLite file (WAL mode), so every worker on the host sees the same data.
+    Tables:
+      - devices:   device_uuid -> record json, seq of the last change, deleted flag
+      - intervals: account/queue -> intervals json (full snapshot, replaced after every sweep)
+      - meta:      monotonic counters (devices_seq, devices_reset_seq, intervals_seq, intervals_updated_at)
+      - leases:    name -> owner, expires_at (populate / sweep leader election, reminders)
+      - profiles:  ring buffer of captured profiles (see sweepProfiler)
+    """
+
+    DEFAULT_PATH = "shared_state.sqlite3"
+
+    # ---------------------------------------------------------
+    # Init
+    # ---------------------------------------------------------
+
+    def __init__(
+        self,
+        path_env_key: str = "SHARED_STATE_PATH",
+        path: Optional[str] = None,
+    ) -> None:
+        self.path = path or os.getenv(path_env_key) or self.DEFAULT_PATH
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}"
+        logger.info(f"Shared state at {self.path}, owner id {self.owner_id}")
+
+        conn = self._connect()
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS devices (
+                    device_uuid TEXT PRIMARY KEY,
+                    record      TEXT NOT NULL,
+                    seq         INTEGER NOT NULL,
+                    deleted     INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS devices_seq_idx ON devices(seq);
+                CREATE TABLE IF NOT EXISTS intervals (
+                    account   TEXT NOT NULL,
+                    queue     TEXT NOT NULL,
+                    intervals TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key   TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS leases (
+                    name       TEXT PRIMARY KEY,
+                    owner      TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS profiles (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind       TEXT NOT NULL,
+                    name       TEXT NOT NULL,
+                    owner      TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    duration   REAL NOT NULL,
+                    tags       TEXT NOT NULL,
+                    summary    TEXT NOT NULL,
+                    stats      BLOB NOT NULL
+                );
+                """
+            )
+        finally:
+            conn.close()
+
+    # ---------------------------------------------------------
+    # Generic helpers
+    # ---------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across workers
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_meta(conn: sqlite3.Connection, key: str) -> float:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_meta(conn: sqlite3.Connection, key: str, value: float) -> None:
+        conn.execute(
+            "INSERT INTO meta(key, value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _bump_seq(self, conn: sqlite3.Connection, key: str) -> int:
+        seq = int(self._get_meta(conn, key)) + 1
+        self._set_meta(conn, key, seq)
+        return seq
+
+    # =========================================================
+    # Devices API
+    # =========================================================
+
+    def devices_seq(self) -> int:
+        conn = self._connect()
+        try:
+            return int(self._get_meta(conn, "devices_seq"))
+        finally:
+            conn.close()
+
+    def replace_devices(self, devices: List[Dict[str, str]]) -> int:
+        """Replace all devices with a fresh snapshot (e.g. read from Sheets). Returns the new seq."""
+        with self._transaction() as conn:
+            seq = self._bump_seq(conn, "devices_seq")
+            self._set_meta(conn, "devices_reset_seq", seq)
+            conn.execute("DELETE FROM devices")
+            conn.executemany(
+                "INSERT OR REPLACE INTO devices(device_uuid, record, seq, deleted) VALUES(?, ?, ?, 0)",
+                [(device["device_uuid"], json.dumps(device), seq) for device in devices],
+            )
+            return seq
+
+    def upsert_device(self, device: Dict[str, str]) -> int:
+        with self._transaction() as conn:
+            seq = self._bump_seq(conn, "devices_seq")
+            conn.execute(
+                "INSERT INTO devices(device_uuid, record, seq, deleted) VALUES(?, ?, ?, 0) "
+                "ON CONFLICT(device_uuid) DO UPDATE SET "
+                "record = excluded.record, seq = excluded.seq, deleted = 0",
+                (device["device_uuid"], json.dumps(device), seq),
+            )
+            return seq
+
+    def list_devices(self) -> Tuple[int, List[Dict[str, str]]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            seq = int(self._get_meta(conn, "devices_seq"))
+            rows = conn.execute(
+                "SELECT record FROM devices WHERE deleted = 0 ORDER BY rowid"
+            ).fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return seq, [json.loads(row[0]) for row in rows]
+
+    def devices_changed_since(
+        self, since_seq: int
+    ) -> Optional[Tuple[int, List[Dict[str, str]], List[str]]]:
+        """
+        Incremental sync: (seq, upserted devices, deleted uuids) changed after since_seq.
+        None if the devices were fully replaced after since_seq, list_devices() is needed then.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            seq = int(self._get_meta(conn, "devices_seq"))
+            if int(self._get_meta(conn, "devices_reset_seq")) > since_seq:
+                conn.execute("COMMIT")
+                return None
+            rows = conn.execute(
+                "SELECT device_uuid, record, deleted FROM devices WHERE seq > ? ORDER BY seq",
+                (since_seq,),
+            ).fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        upserted = [json.loads(record) for _, record, deleted in rows if not deleted]
+        deleted = [device_uuid for device_uuid, _, deleted in rows if deleted]
+        return seq, upserted, deleted
+
+    # =========================================================
+    # Intervals API
+    # =========================================================
+
+    def intervals_seq(self) -> int:
+        conn = self._connect()
+        try:
+            return int(self._get_meta(conn, "intervals_seq"))
+        finally:
+            conn.close()
+
+    def intervals_updated_at(self) -> float:
+        """Unix time of the last intervals snapshot (end of the last sweep), 0 if never saved."""
+        conn = self._connect()
+        try:
+            return self._get_meta(conn, "intervals_updated_at")
+        finally:
+            conn.close()
+
+    def replace_intervals(self, intervals: List[Dict[str, str]]) -> int:
+        with self._transaction() as conn:
+            seq = self._bump_seq(conn, "intervals_seq")
+            self._set_meta(conn, "intervals_updated_at", time.time())
+            conn.execute("DELETE FROM intervals")
+            conn.executemany(
+                "INSERT INTO intervals(account, queue, intervals) VALUES(?, ?, ?)",
+                [
+                    (str(record.get("account", "")), record.get("queue", ""), record.get("intervals", ""))
+                    for record in intervals
+                ],
+            )
+            return seq
+
+    def list_intervals(self) -> Tuple[int, List[Dict[str, str]]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            seq = int(self._get_meta(conn, "intervals_seq"))
+            rows = conn.execute(
+                "SELECT account, queue, intervals FROM intervals ORDER BY rowid"
+            ).fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return seq, [
+            {"account": account, "queue": queue, "intervals": intervals}
+            for account, queue, intervals in rows
+        ]
+
+    # =========================================================
+    # Leases API
+    # =========================================================
+
+    def try_acquire_lease(self, name: str, ttl_seconds: float) -> bool:
+        """Take (or extend) the named lease for this worker. False if another worker holds it."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT owner, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if row and row[0] != self.owner_id and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT INTO leases(name, owner, expires_at) VALUES(?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at",
+                (name, self.owner_id, now + ttl_seconds),
+            )
+            return True
+
+    def lease_held(self, name: str) -> bool:
+        """True if another worker holds the named lease."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT owner, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return bool(row) and row[0] != self.owner_id and row[1] > time.time()
+
+    def purge_expired_leases(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (time.time(),))
+
+    def release_lease(self, name: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                (name, self.owner_id),
+            )
+
+    # =========================================================
+    # Profiling API
+    # =========================================================
+
+    def set_profiling(self, kind: str, count: int) -> None:
+        with self._transaction() as conn:
+            self._set_meta(conn, f"profile_{kind}", count)
+
+    def profiling_count(self, kind: str) -> int:
+        conn = self._connect()
+        try:
+            return int(self._get_meta(conn, f"profile_{kind}"))
+        finally:
+            conn.close()
+
+    def take_profiling(self, kind: str) -> bool:
+        """Atomically use one of the armed profiling runs. False if none are left."""
+        with self._transaction() as conn:
+            count = int(self._get_meta(conn, f"profile_{kind}"))
+            if count <= 0:
+                return False
+            self._set_meta(conn, f"profile_{kind}", count - 1)
+            return True
+
+    def add_profile(self, profile: Dict, keep: int) -> int:
+        """Store a profile, dropping the oldest ones beyond keep. Returns the profile id."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO profiles(kind, name, owner, started_at, duration, tags, summary, stats) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    profile["kind"], profile["name"], self.owner_id, profile["started_at"],
+                    profile["duration"], json.dumps(profile["tags"]), profile["summary"], profile["stats"],
+                ),
+            )
+            profile_id = cursor.lastrowid
+            conn.execute("DELETE FROM profiles WHERE id <= ?", (profile_id - keep,))
+            return profile_id
+
+    def list_profiles(self) -> List[Dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, name, owner, started_at, duration, tags FROM profiles ORDER BY id DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "id": profile_id,
+                "kind": kind,
+                "name": name,
+                "owner": owner,
+                "started_at": started_at,
+                "duration": duration,
+                "tags": json.loads(tags),
+            }
+            for profile_id, kind, name, owner, started_at, duration, tags in rows
+        ]
+
+    def get_profile(self, profile_id: int) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT kind, name, tags, summary, stats FROM profiles WHERE id = ?", (profile_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        kind, name, tags, summary, stats = row
+        return {"id": profile_id, "kind": kind, "name": name, "tags": json.loads(tags), "summary": summary, "stats": stats}
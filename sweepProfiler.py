@@ -0,0 +1,136 @@
+import asyncio
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import marshal
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+from sharedState import SharedStateStore
+
+logger = logging.getLogger(__name__)
+
+
+class SweepProfiler:
+    """
+    On-demand cProfile capture of the next N sweeps ("sweep") or HTTP requests ("request").
+    Armed counts and captured profiles live in the shared state, so arming and downloading
+    work whatever worker serves the admin request. Profiles are kept in a ring buffer of `keep`.
+    When nothing is armed the cost is one cached counter check (refreshed every refresh_interval).
+    cProfile only sees the thread it runs in, so profiling must start in the thread doing the work:
+    sync endpoints are wrapped with profiled() (runs in their threadpool thread, async endpoints are not profiled),
+    the sweep is profiled inside its thread. Work done in polling threads still shows up as waiting,
+    use the phase tags of the sweep for the wall time breakdown.
+    """
+
+    KINDS = ("sweep", "request")
+
+    def __init__(
+            self,
+            shared_state: SharedStateStore,
+            keep: int = 20,
+            refresh_interval: float = 1.0):
+        self.shared_state = shared_state
+        self.keep = keep
+        self.refresh_interval = refresh_interval
+        self._armed: Dict[str, int] = {kind: 0 for kind in self.KINDS}
+        self._checked_at: Dict[str, float] = {kind: 0.0 for kind in self.KINDS}
+        # One profile at a time per process
+        self._active = threading.Lock()
+
+    def arm(self, kind: str, count: int) -> None:
+        self.shared_state.set_profiling(kind, count)
+        self._armed[kind] = count
+        self._checked_at[kind] = time.monotonic()
+        logger.info(f"Profiling armed for the next {count} {kind}(s)")
+
+    def armed(self, kind: str) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at[kind] >= self.refresh_interval:
+            self._checked_at[kind] = now
+            self._armed[kind] = self.shared_state.profiling_count(kind)
+        return self._armed[kind] > 0
+
+    def profiled(self, kind: str = "request") -> Callable:
+        """
+        Sync endpoint decorator, profiles the call in the threadpool thread that runs it.
+        Async endpoints are not supported: the counter refresh would query SQLite on the event loop,
+        and a profile enabled on the loop thread records every coroutine that runs meanwhile.
+        """
+        def decorator(func: Callable) -> Callable:
+            if asyncio.iscoroutinefunction(func):
+                raise TypeError(f"profiled() supports sync endpoints only, {func.__name__} is async")
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.armed(kind):
+                    return func(*args, **kwargs)
+                with self.profile(kind, func.__name__):
+                    return func(*args, **kwargs)
+
+            # FastAPI resolves string annotations with the wrapper's globals (this module), resolve them here
+            wrapper.__signature__ = inspect.signature(func, eval_str=True)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def profile(self, kind: str, name: str) -> Iterator[Dict[str, float]]:
+        """Profile the block if a run of this kind is armed. Values put into the yielded dict are saved as tags."""
+        tags: Dict[str, float] = {}
+        if not self.armed(kind) or not self._active.acquire(blocking=False):
+            yield tags
+            return
+
+        try:
+            if not self.shared_state.take_profiling(kind):
+                self._armed[kind] = 0
+                yield tags
+                return
+
+            profiler = cProfile.Profile()
+            started_at = time.time()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                yield tags
+            finally:
+                profiler.disable()
+                self._save(kind, name, profiler, started_at, time.perf_counter() - started, tags)
+        finally:
+            self._active.release()
+
+    def _save(
+            self,
+            kind: str,
+            name: str,
+            profiler: cProfile.Profile,
+            started_at: float,
+            duration: float,
+            tags: Dict[str, float]) -> None:
+        try:
+            profiler.create_stats()
+            # Same format as pstats.Stats.dump_stats, loadable with pstats.Stats(path).
+            # Serialized first: pstats.Stats(profiler) takes the stats out of the profiler
+            stats = marshal.dumps(profiler.stats)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+            profile_id = self.shared_state.add_profile(
+                {
+                    "kind": kind,
+                    "name": name,
+                    "started_at": started_at,
+                    "duration": duration,
+                    "tags": tags,
+                    "summary": summary.getvalue(),
+                    "stats": stats,
+                },
+                keep=self.keep,
+            )
+            logger.info(f"Saved {kind} profile {profile_id} of {name}. Duration: {duration:.3f}s. Tags: {tags}")
+        except Exception as e:
+            logger.error(f"Failed to save {kind} profile of {name}: {e}")
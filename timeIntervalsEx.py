@@ -1,3 +1,4 @@
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from typing import List, Optional, Tuple
@@ -22,6 +23,8 @@ class TimeIntervalsEX:
     # MARK: - Init / Storage
     def __init__(self) -> None:
         self.intervals: List[TimeIntervalsEX.Interval] = []
+        # Starts of the sorted merged intervals, for bisect lookups
+        self._starts: List[datetime] = []
 
     # MARK: - Append with merge
     def append(self, range_: Tuple[str, str]) -> None:
@@ -46,6 +49,7 @@ class TimeIntervalsEX:
     # MARK: - Merge logic
     def _merge_intervals(self) -> None:
         if len(self.intervals) <= 1:
+            self._starts = [interval.start for interval in self.intervals]
             return
 
         self.intervals.sort(key=lambda i: i.start)
@@ -65,14 +69,20 @@ class TimeIntervalsEX:
 
         merged.append(current)
         self.intervals = merged
+        self._starts = [interval.start for interval in merged]
 
     # MARK: - Interval lookup
+    # Intervals are sorted and don't overlap, so the only candidate is the last one starting before date
     def interval_containing(self, date: datetime) -> Optional[Interval]:
-        for interval in self.intervals:
-            if interval.start <= date <= interval.end:
-                return interval
+        index = bisect_right(self._starts, date) - 1
+        if index >= 0 and date <= self.intervals[index].end:
+            return self.intervals[index]
         return None
 
+    def next_interval(self, date: datetime) -> Optional[Interval]:
+        index = bisect_right(self._starts, date)
+        return self.intervals[index] if index < len(self.intervals) else None
+
     def is_in(self, date: datetime) -> bool:
         return self.interval_containing(date) is not None
 